@@ -4,13 +4,16 @@ Temporary mock auth service to bypass the UUID/int type mismatch issue
 in the platform-services while tests are run.
 """
 
+import base64
+import hashlib
+import hmac
+import itertools
 import json
 import os
-import jwt
-from datetime import datetime, timedelta
+import time
+from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import uvicorn
 
 # Environment variable validation
 def validate_required_env_vars():
@@ -42,43 +45,98 @@ class LoginResponse(BaseModel):
     refresh_token: str
     token_type: str = "Bearer"
 
-# Mock user database
+def _hash_password(password: str) -> bytes:
+    return hashlib.sha256(password.encode()).digest()
+
+# Mock user database; passwords are stored as SHA-256 digests
 MOCK_USERS = {
     "testuser@example.com": {
         "id": 1,  # Using integer ID as expected by NextAuth
         "email": "testuser@example.com",
-        "password": "TestPassword123",
+        "password": _hash_password("TestPassword123"),
         "role": "user",
         "tenant_id": "test-tenant-1"
     }
 }
 
+# Ids for registered users, allocated without looking at MOCK_USERS
+_next_user_id = itertools.count(len(MOCK_USERS) + 1)
+
+# Issued token pairs keyed by a digest of the credentials, so repeated logins
+# within the token lifetime skip re-signing. Entries expire an hour before the
+# tokens do, which keeps every cached token valid for at least that long.
+TOKEN_CACHE_TTL = 23 * 3600
+_token_cache = {}
+
+def _credentials_key(email: str, password_hash: bytes) -> bytes:
+    return hashlib.blake2b(email.encode() + b":" + password_hash, digest_size=16).digest()
+
+# HS256 signing without PyJWT: the header segment never changes and the HMAC
+# key schedule is computed once, then copied for every token.
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+_JWT_HEADER = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+_base_hmac = hmac.new(JWT_SECRET.encode(), digestmod=hashlib.sha256)
+
+def _encode_hs256(claims: bytes) -> str:
+    """Build a signed JWT from already-serialized JSON claims"""
+    signing_input = _JWT_HEADER + b"." + _b64url(claims)
+    mac = _base_hmac.copy()
+    mac.update(signing_input)
+    return (signing_input + b"." + _b64url(mac.digest())).decode()
+
+# (second, iat, exp) for the most recent login; tokens issued within the same
+# second share their timestamps.
+ACCESS_TOKEN_LIFETIME = 24 * 3600
+_token_times = (0, 0, 0)
+
+def _token_timestamps():
+    """Return integer (iat, exp) epochs at one-second granularity"""
+    global _token_times
+    now = int(time.time())
+    if _token_times[0] != now:
+        _token_times = (now, now, now + ACCESS_TOKEN_LIFETIME)
+    return _token_times[1], _token_times[2]
+
 @app.post("/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     """Mock login endpoint that returns proper JWT tokens"""
     user = MOCK_USERS.get(request.email)
+    password_hash = _hash_password(request.password)
     
-    if not user or user["password"] != request.password:
+    if not user or not hmac.compare_digest(user["password"], password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Reuse the previously issued pair while it is still fresh
+    cache_key = _credentials_key(request.email, password_hash)
+    cached = _token_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
     # Create JWT payload
+    iat, exp = _token_timestamps()
     payload = {
         "user_id": user["id"],
         "email": user["email"],
         "role": user["role"],
         "tenant_id": user["tenant_id"],
-        "exp": datetime.utcnow() + timedelta(hours=24),
-        "iat": datetime.utcnow()
+        "exp": exp,
+        "iat": iat
     }
     
-    # Generate tokens
-    access_token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
-    refresh_token = jwt.encode({**payload, "type": "refresh"}, JWT_SECRET, algorithm="HS256")
+    # Generate tokens; the refresh claims are the access claims plus "type"
+    claims = json.dumps(payload, separators=(",", ":")).encode()
+    access_token = _encode_hs256(claims)
+    refresh_token = _encode_hs256(claims[:-1] + b',"type":"refresh"}')
     
-    return LoginResponse(
+    response = LoginResponse(
         access_token=access_token,
         refresh_token=refresh_token
     )
+    _token_cache[cache_key] = (time.monotonic() + TOKEN_CACHE_TTL, response)
+    
+    return response
 
 @app.post("/auth/register")
 async def register(request: LoginRequest):
@@ -86,12 +144,14 @@ async def register(request: LoginRequest):
     if request.email in MOCK_USERS:
         raise HTTPException(status_code=409, detail="Email already registered")
     
+    password_hash = _hash_password(request.password)
+    user_id = next(_next_user_id)
     MOCK_USERS[request.email] = {
-        "id": len(MOCK_USERS) + 1,
+        "id": user_id,
         "email": request.email,
-        "password": request.password,
+        "password": password_hash,
         "role": "user",
-        "tenant_id": f"tenant-{len(MOCK_USERS) + 1}"
+        "tenant_id": f"tenant-{user_id}"
     }
     
     return {"message": "User registered successfully"}
@@ -102,6 +162,25 @@ async def health():
     return {"status": "healthy", "service": "mock-auth-service"}
 
 if __name__ == "__main__":
-    print("Starting mock auth service on port 8009...")
+    # Only needed to serve; importing the module for its app skips it
+    import uvicorn
+    
+    # Users, ids and cached tokens live in process memory, so a single worker
+    # is the only correct default. Extra workers are opt-in for login-only load
+    # tests, where nothing registered on one worker has to be seen by another.
+    workers = int(os.getenv("MOCK_AUTH_WORKERS", "1"))
+    print(f"Starting mock auth service on port 8009 with {workers} worker(s)...")
     print("This is a temporary solution to bypass UUID/int type mismatch in platform-services")
-    uvicorn.run(app, host="0.0.0.0", port=8009)
\ No newline at end of file
+    # Workers import the app by string; "auto" picks uvloop/httptools when
+    # uvicorn[standard] is installed
+    uvicorn.run(
+        f"{Path(__file__).stem}:app",
+        app_dir=str(Path(__file__).resolve().parent),
+        host="0.0.0.0",
+        port=8009,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        log_level="warning",
+        access_log=False
+    )
\ No newline at end of file
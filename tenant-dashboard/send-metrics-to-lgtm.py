@@ -4,229 +4,281 @@ Send Playwright test metrics to LGTM monitoring stack
 Pushes test results to Prometheus, logs to Loki, and creates Grafana annotations
 """
 
-import json
+import asyncio
+import io
+import mmap
+import os
 import time
-import requests
+import orjson
 import sys
 from datetime import datetime
 from pathlib import Path
 
+# Test categories in reporting order; tests are tagged with their index
+CATEGORIES = ('core_tests', 'visual_tests', 'mobile_tests', 'airtable_integration')
+CATEGORY_IDS = {category: index for index, category in enumerate(CATEGORIES)}
+
+# Prometheus exposition lines written for every category
+PROMETHEUS_CATEGORY_TEMPLATE = (
+    'playwright_tests_total{{category="{category}"}} {data[total]}\n'
+    'playwright_tests_passed{{category="{category}"}} {data[passed]}\n'
+    'playwright_tests_failed{{category="{category}"}} {data[failed]}\n'
+    'playwright_success_rate{{category="{category}"}} {data[success_rate]}\n'
+    'playwright_avg_duration_ms{{category="{category}"}} {data[avg_duration]}\n'
+)
+
+# Reports larger than this are streamed with ijson instead of parsed in one go
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Status codes are assigned as new statuses appear; passed is always 0
+STATUS_PASSED = 0
+
+def _iter_tests(root):
+    """Yield (title, status, duration, error message) for every test in a suite
+    and its nested suites, depth first"""
+    stack = [root]
+    while stack:
+        suite = stack.pop()
+        for test in suite.get('tests', ()):
+            yield (
+                test.get('title'),
+                test.get('status', 'unknown'),
+                test.get('duration', 0),
+                (test.get('error') or {}).get('message')
+            )
+        stack.extend(reversed(suite.get('suites', ())))
+
 class LGTMMetricsSender:
     def __init__(self):
         self.prometheus_url = "http://localhost:9090"
         self.loki_url = "http://localhost:3100"
         self.grafana_url = "http://localhost:3003"
+        self.pushgateway_url = self.prometheus_url.replace('9090', '9091')
+        # Updated by check_endpoints; payloads are only built for reachable services
+        self.prometheus_ok = True
+        self.loki_ok = True
+        self.grafana_ok = True
         self.timestamp = int(time.time() * 1000)
+        self.loki_timestamp = f"{self.timestamp}000000"  # Loki expects nanoseconds
         
     def read_test_results(self):
-        """Read Playwright test results from JSON files"""
+        """Open Playwright test results as lazy streams of top-level suites"""
         results_file = Path("test-results-simple/results.json")
         visual_results_file = Path("test-results-visual/results.json")
         
         results = {}
         
         if results_file.exists():
-            with open(results_file, 'r') as f:
-                results['core'] = json.load(f)
+            results['core'] = self._iter_suites(results_file)
                 
         if visual_results_file.exists():
-            with open(visual_results_file, 'r') as f:
-                results['visual'] = json.load(f)
+            results['visual'] = self._iter_suites(visual_results_file)
         
         return results
     
-    def extract_metrics(self, results):
-        """Extract key metrics from test results"""
-        metrics = {
-            'core_tests': {
-                'total': 0,
-                'passed': 0,
-                'failed': 0,
-                'success_rate': 0,
-                'avg_duration': 0,
-                'total_duration': 0
-            },
-            'visual_tests': {
-                'total': 0,
-                'passed': 0,
-                'failed': 0,
-                'success_rate': 0,
-                'avg_duration': 0,
-                'total_duration': 0
-            },
-            'mobile_tests': {
-                'total': 0,
-                'passed': 0,
-                'failed': 0,
-                'success_rate': 0
-            },
-            'airtable_integration': {
-                'total': 0,
-                'passed': 0,
-                'failed': 0,
-                'success_rate': 0
-            }
-        }
+    @staticmethod
+    def _iter_suites(path):
+        """Yield top-level suites from a memory-mapped report, parsed straight
+        from its bytes and streamed when the report is very large"""
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if size > STREAMING_THRESHOLD_BYTES:
+                    import ijson
+                    yield from ijson.items(mm, 'suites.item', use_float=True)
+                    return
+                with memoryview(mm) as view:
+                    report = orjson.loads(view)
+        yield from report.get('suites', ())
+    
+    async def check_endpoints(self, client):
+        """Probe each LGTM service once so unreachable ones can be skipped"""
+        self.prometheus_ok, self.loki_ok, self.grafana_ok = await asyncio.gather(
+            self._is_reachable(client, f"{self.pushgateway_url}/-/ready"),
+            self._is_reachable(client, f"{self.loki_url}/ready"),
+            self._is_reachable(client, f"{self.grafana_url}/api/health")
+        )
+    
+    @staticmethod
+    async def _is_reachable(client, url):
+        import httpx
+        
+        try:
+            await client.get(url, timeout=0.5)
+            return True
+        except httpx.HTTPError:
+            return False
+    
+    def extract_metrics_and_failures(self, results, collect_failures=True):
+        """Extract key metrics and failure log entries from one pass over the results"""
+        import numpy as np
+        
+        # Tests are kept as parallel columns rather than one dict per test
+        status_codes = {'passed': STATUS_PASSED}
+        category_ids = []
+        titles = []
+        statuses = []
+        durations = []
+        errors = []
         
-        for test_type, data in results.items():
-            if 'suites' in data:
-                for suite in data['suites']:
-                    for test in self._extract_tests_from_suite(suite):
-                        test_name = test.get('title', '').lower()
-                        status = test.get('status', 'unknown')
-                        duration = test.get('duration', 0)
-                        
-                        # Categorize tests
-                        if 'airtable' in test_name or 'integration' in test_name:
-                            category = 'airtable_integration'
-                        elif 'mobile' in test_name or test_type == 'visual':
-                            category = 'mobile_tests'
-                        elif test_type == 'visual':
-                            category = 'visual_tests'
-                        else:
-                            category = 'core_tests'
-                        
-                        metrics[category]['total'] += 1
-                        metrics[category]['total_duration'] += duration
-                        
-                        if status == 'passed':
-                            metrics[category]['passed'] += 1
-                        else:
-                            metrics[category]['failed'] += 1
+        for test_type, suites in results.items():
+            # Tests without a category keyword; visual runs count as mobile tests
+            default_category_id = CATEGORY_IDS['mobile_tests' if test_type == 'visual' else 'core_tests']
+            for suite in suites:
+                for title, status, duration, error in _iter_tests(suite):
+                    test_name = (title or '').lower()
+                    
+                    # Categorize tests
+                    if 'airtable' in test_name or 'integration' in test_name:
+                        category_ids.append(CATEGORY_IDS['airtable_integration'])
+                    elif 'mobile' in test_name:
+                        category_ids.append(CATEGORY_IDS['mobile_tests'])
+                    else:
+                        category_ids.append(default_category_id)
+                    titles.append(title)
+                    statuses.append(status_codes.setdefault(status, len(status_codes)))
+                    durations.append(duration)
+                    errors.append(error)
+        
+        # Aggregate per category in bulk rather than bumping counters per test
+        category_ids = np.array(category_ids, dtype=np.int8)
+        status_array = np.array(statuses, dtype=np.int8)
+        passed = status_array == STATUS_PASSED
+        totals = np.bincount(category_ids, minlength=len(CATEGORIES))
+        total_durations = np.bincount(
+            category_ids, weights=np.array(durations, dtype=np.float64), minlength=len(CATEGORIES)
+        )
+        passed_counts = np.bincount(category_ids[passed], minlength=len(CATEGORIES))
+        
+        # The result streams can only be consumed once, so Loki failure entries
+        # are built here rather than in a second walk from send_to_loki. They
+        # are (timestamp, line) pairs, ready to use as Loki stream values.
+        failure_entries = []
+        if collect_failures:
+            status_names = list(status_codes)
+            for index in np.flatnonzero(~passed):
+                failure_entries.append((self.loki_timestamp, orjson.dumps({
+                    "level": "error",
+                    "service": "playwright_tests",
+                    "test_name": 'Unknown' if titles[index] is None else titles[index],
+                    "status": status_names[statuses[index]],
+                    "duration": durations[index],
+                    "error": 'No error message' if errors[index] is None else errors[index],
+                    "timestamp": datetime.now().isoformat()
+                }).decode()))
         
         # Calculate success rates and averages
-        for category in metrics:
-            total = metrics[category]['total']
-            if total > 0:
-                metrics[category]['success_rate'] = (metrics[category]['passed'] / total) * 100
-                metrics[category]['avg_duration'] = metrics[category]['total_duration'] / total
-            else:
-                metrics[category]['success_rate'] = 0
-                metrics[category]['avg_duration'] = 0
+        metrics = {}
+        for category_id, category in enumerate(CATEGORIES):
+            total = int(totals[category_id])
+            category_passed = int(passed_counts[category_id])
+            total_duration = float(total_durations[category_id])
+            metrics[category] = {
+                'total': total,
+                'passed': category_passed,
+                'failed': total - category_passed,
+                'success_rate': (category_passed / total) * 100 if total > 0 else 0,
+                'avg_duration': total_duration / total if total > 0 else 0,
+                'total_duration': total_duration
+            }
         
-        return metrics
-    
-    def _extract_tests_from_suite(self, suite):
-        """Recursively extract all tests from a suite"""
-        tests = []
-        if 'tests' in suite:
-            tests.extend(suite['tests'])
-        if 'suites' in suite:
-            for subsuite in suite['suites']:
-                tests.extend(self._extract_tests_from_suite(subsuite))
-        return tests
+        return metrics, failure_entries
     
-    def send_to_prometheus(self, metrics):
+    async def send_to_prometheus(self, client, metrics):
         """Send metrics to Prometheus via pushgateway or direct metrics endpoint"""
-        prometheus_metrics = []
+        import httpx
         
+        buffer = io.StringIO()
         for category, data in metrics.items():
-            prometheus_metrics.extend([
-                f'playwright_tests_total{{category="{category}"}} {data["total"]}',
-                f'playwright_tests_passed{{category="{category}"}} {data["passed"]}',
-                f'playwright_tests_failed{{category="{category}"}} {data["failed"]}',
-                f'playwright_success_rate{{category="{category}"}} {data["success_rate"]}',
-                f'playwright_avg_duration_ms{{category="{category}"}} {data["avg_duration"]}'
-            ])
+            buffer.write(PROMETHEUS_CATEGORY_TEMPLATE.format(category=category, data=data))
         
         # Add timestamp metrics
-        prometheus_metrics.append(f'playwright_test_execution_timestamp {self.timestamp}')
+        buffer.write(f'playwright_test_execution_timestamp {self.timestamp}\n')
+        payload = buffer.getvalue()
         
-        try:
-            # Try to push to Prometheus pushgateway (if available)
-            pushgateway_url = f"{self.prometheus_url.replace('9090', '9091')}/metrics/job/playwright_tests"
-            
-            payload = "\\n".join(prometheus_metrics)
-            response = requests.post(pushgateway_url, data=payload, timeout=5)
-            
-            if response.status_code == 200:
-                print(f"✅ Metrics sent to Prometheus pushgateway")
-                return True
-        except requests.exceptions.RequestException:
-            pass
+        if self.prometheus_ok:
+            try:
+                # Try to push to Prometheus pushgateway (if available)
+                response = await client.post(
+                    f"{self.pushgateway_url}/metrics/job/playwright_tests", content=payload, timeout=5
+                )
+                
+                if response.status_code == 200:
+                    print(f"✅ Metrics sent to Prometheus pushgateway")
+                    return True
+            except httpx.HTTPError:
+                pass
         
         # Fallback: Print metrics for manual collection
         print("📊 Prometheus Metrics (manual collection needed):")
-        for metric in prometheus_metrics:
+        for metric in payload.splitlines():
             print(f"  {metric}")
         
         return False
     
-    def send_to_loki(self, metrics, results):
+    async def send_to_loki(self, client, metrics, failure_entries):
         """Send structured logs to Loki"""
+        import httpx
+        
         log_entries = []
         
         # Create log entries for each test category
         for category, data in metrics.items():
-            log_entry = {
-                "timestamp": f"{self.timestamp}000000",  # Loki expects nanoseconds
-                "line": json.dumps({
-                    "level": "info",
-                    "service": "playwright_tests",
-                    "category": category,
-                    "total_tests": data["total"],
-                    "passed": data["passed"],
-                    "failed": data["failed"],
-                    "success_rate": data["success_rate"],
-                    "avg_duration_ms": data["avg_duration"],
-                    "timestamp": datetime.now().isoformat()
-                })
-            }
-            log_entries.append(log_entry)
+            log_entries.append((self.loki_timestamp, orjson.dumps({
+                "level": "info",
+                "service": "playwright_tests",
+                "category": category,
+                "total_tests": data["total"],
+                "passed": data["passed"],
+                "failed": data["failed"],
+                "success_rate": data["success_rate"],
+                "avg_duration_ms": data["avg_duration"],
+                "timestamp": datetime.now().isoformat()
+            }).decode()))
         
-        # Add failure details
-        for test_type, data in results.items():
-            if 'suites' in data:
-                for suite in data['suites']:
-                    for test in self._extract_tests_from_suite(suite):
-                        if test.get('status') != 'passed':
-                            error_entry = {
-                                "timestamp": f"{self.timestamp}000000",
-                                "line": json.dumps({
-                                    "level": "error",
-                                    "service": "playwright_tests",
-                                    "test_name": test.get('title', 'Unknown'),
-                                    "status": test.get('status', 'unknown'),
-                                    "duration": test.get('duration', 0),
-                                    "error": test.get('error', {}).get('message', 'No error message'),
-                                    "timestamp": datetime.now().isoformat()
-                                })
-                            }
-                            log_entries.append(error_entry)
-        
-        # Send to Loki
-        loki_payload = {
-            "streams": [
-                {
-                    "stream": {"job": "playwright_tests", "service": "frontend_testing"},
-                    "values": [[entry["timestamp"], entry["line"]] for entry in log_entries]
-                }
-            ]
-        }
-        
-        try:
-            response = requests.post(
-                f"{self.loki_url}/loki/api/v1/push",
-                json=loki_payload,
-                headers={"Content-Type": "application/json"},
-                timeout=5
-            )
+        if self.loki_ok:
+            # Add failure details
+            log_entries.extend(failure_entries)
+            
+            # Send to Loki
+            loki_payload = {
+                "streams": [
+                    {
+                        "stream": {"job": "playwright_tests", "service": "frontend_testing"},
+                        "values": log_entries
+                    }
+                ]
+            }
             
-            if response.status_code == 204:
-                print(f"✅ Logs sent to Loki ({len(log_entries)} entries)")
-                return True
-        except requests.exceptions.RequestException as e:
-            pass
+            try:
+                response = await client.post(
+                    f"{self.loki_url}/loki/api/v1/push",
+                    content=orjson.dumps(loki_payload),
+                    headers={"Content-Type": "application/json"},
+                    timeout=5
+                )
+                
+                if response.status_code == 204:
+                    print(f"✅ Logs sent to Loki ({len(log_entries)} entries)")
+                    return True
+            except httpx.HTTPError:
+                pass
         
+        # One summary entry per category plus one per failed test
+        entry_count = len(metrics) + sum(data['failed'] for data in metrics.values())
         print("📝 Loki Logs (manual collection needed):")
-        for entry in log_entries[:3]:  # Show first 3 entries
-            print(f"  {json.loads(entry['line'])}")
-        print(f"  ... and {len(log_entries) - 3} more entries")
+        for _, line in log_entries[:3]:  # Show first 3 entries
+            print(f"  {orjson.loads(line)}")
+        print(f"  ... and {entry_count - 3} more entries")
         
         return False
     
-    def create_grafana_annotation(self, metrics):
+    async def create_grafana_annotation(self, client, metrics):
         """Create Grafana annotation for test run"""
+        import httpx
+        
         total_tests = sum(data['total'] for data in metrics.values())
         total_passed = sum(data['passed'] for data in metrics.values())
         overall_success_rate = (total_passed / total_tests) * 100 if total_tests > 0 else 0
@@ -242,27 +294,28 @@ class LGTMMetricsSender:
                    f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         }
         
-        try:
-            # Try to create annotation via Grafana API
-            response = requests.post(
-                f"{self.grafana_url}/api/annotations",
-                json=annotation,
-                headers={"Authorization": "Bearer admin", "Content-Type": "application/json"},
-                timeout=5
-            )
-            
-            if response.status_code in [200, 201]:
-                print(f"✅ Grafana annotation created")
-                return True
-        except requests.exceptions.RequestException:
-            pass
+        if self.grafana_ok:
+            try:
+                # Try to create annotation via Grafana API
+                response = await client.post(
+                    f"{self.grafana_url}/api/annotations",
+                    content=orjson.dumps(annotation),
+                    headers={"Authorization": "Bearer admin", "Content-Type": "application/json"},
+                    timeout=5
+                )
+                
+                if response.status_code in [200, 201]:
+                    print(f"✅ Grafana annotation created")
+                    return True
+            except httpx.HTTPError:
+                pass
         
         print("📈 Grafana Annotation (manual creation needed):")
         print(f"  {annotation}")
         
         return False
     
-    def run(self):
+    async def run(self):
         """Main execution function"""
         print("🚀 Starting LGTM metrics collection for Playwright tests...")
         
@@ -272,31 +325,46 @@ class LGTMMetricsSender:
             print("❌ No test results found")
             return False
         
-        # Extract metrics
-        metrics = self.extract_metrics(results)
+        # HTTP, numpy and ijson are imported where they are used, so runs that
+        # stop early (like the one above) skip their import cost
+        import httpx
         
-        # Print summary
-        total_tests = sum(data['total'] for data in metrics.values())
-        total_passed = sum(data['passed'] for data in metrics.values())
-        overall_success_rate = (total_passed / total_tests) * 100 if total_tests > 0 else 0
-        
-        print(f"\\n📊 Test Results Summary:")
-        print(f"  Total Tests: {total_tests}")
-        print(f"  Passed: {total_passed}")
-        print(f"  Failed: {total_tests - total_passed}")
-        print(f"  Overall Success Rate: {overall_success_rate:.1f}%")
-        
-        print(f"\\n📈 Category Breakdown:")
-        for category, data in metrics.items():
-            if data['total'] > 0:
-                print(f"  {category}: {data['passed']}/{data['total']} ({data['success_rate']:.1f}%)")
-        
-        # Send to monitoring systems
-        print(f"\\n📤 Sending to LGTM stack...")
-        
-        prometheus_success = self.send_to_prometheus(metrics)
-        loki_success = self.send_to_loki(metrics, results)
-        grafana_success = self.create_grafana_annotation(metrics)
+        # One keep-alive pool shared by the probes and the pushes
+        limits = httpx.Limits(max_keepalive_connections=8)
+        async with httpx.AsyncClient(limits=limits) as client:
+            # Probe the stack first; failure entries are only built if Loki is up
+            await self.check_endpoints(client)
+            
+            # Extract metrics
+            metrics, failure_entries = self.extract_metrics_and_failures(
+                results, collect_failures=self.loki_ok
+            )
+            
+            # Print summary
+            total_tests = sum(data['total'] for data in metrics.values())
+            total_passed = sum(data['passed'] for data in metrics.values())
+            overall_success_rate = (total_passed / total_tests) * 100 if total_tests > 0 else 0
+            
+            print(f"\\n📊 Test Results Summary:")
+            print(f"  Total Tests: {total_tests}")
+            print(f"  Passed: {total_passed}")
+            print(f"  Failed: {total_tests - total_passed}")
+            print(f"  Overall Success Rate: {overall_success_rate:.1f}%")
+            
+            print(f"\\n📈 Category Breakdown:")
+            for category, data in metrics.items():
+                if data['total'] > 0:
+                    print(f"  {category}: {data['passed']}/{data['total']} ({data['success_rate']:.1f}%)")
+            
+            # Send to monitoring systems
+            print(f"\\n📤 Sending to LGTM stack...")
+            
+            # The three pushes are independent, so run them concurrently
+            prometheus_success, loki_success, grafana_success = await asyncio.gather(
+                self.send_to_prometheus(client, metrics),
+                self.send_to_loki(client, metrics, failure_entries),
+                self.create_grafana_annotation(client, metrics)
+            )
         
         print(f"\\n✅ LGTM Integration Summary:")
         print(f"  Prometheus: {'✅ Success' if prometheus_success else '❌ Failed (metrics printed)'}")
@@ -307,5 +375,5 @@ class LGTMMetricsSender:
 
 if __name__ == "__main__":
     sender = LGTMMetricsSender()
-    success = sender.run()
+    success = asyncio.run(sender.run())
     sys.exit(0 if success else 1)
\ No newline at end of file
@@ -3,8 +3,9 @@
 Simple metrics summary for Playwright test results
 """
 
-import json
-import requests
+import asyncio
+import io
+import orjson
 from datetime import datetime
 import time
 
@@ -40,6 +41,43 @@ test_metrics = {
     }
 }
 
+# Prometheus exposition lines written for every category
+PROMETHEUS_CATEGORY_TEMPLATE = (
+    'playwright_tests_total{{category="{category}",browser="chromium"}} {data[total]}\n'
+    'playwright_tests_passed{{category="{category}",browser="chromium"}} {data[passed]}\n'
+    'playwright_tests_failed{{category="{category}",browser="chromium"}} {data[failed]}\n'
+    'playwright_success_rate{{category="{category}",browser="chromium"}} {data[success_rate]}\n'
+    'playwright_avg_duration_ms{{category="{category}",browser="chromium"}} {data[avg_duration]}\n'
+)
+
+# (service, health URL, message when it answers with a non-200 status)
+LGTM_HEALTH_CHECKS = (
+    ("Prometheus", "http://localhost:9090/api/v1/status/config", "API returned non-200"),
+    ("Loki", "http://localhost:3100/ready", "health check failed"),
+    ("Grafana", "http://localhost:3003/api/health", "health check failed")
+)
+
+async def check_service(client, name, url, unhealthy_message):
+    import httpx
+    
+    try:
+        response = await client.get(url)
+        if response.status_code == 200:
+            return f"  ✅ {name}: Running and accessible"
+        return f"  ⚠️ {name}: Running but {unhealthy_message}"
+    except httpx.HTTPError:
+        return f"  ❌ {name}: Not accessible"
+
+async def check_lgtm_services():
+    """Check all LGTM services concurrently, returning status lines in order"""
+    # Deferred so the summary can be printed without loading the HTTP client
+    import httpx
+    
+    async with httpx.AsyncClient(timeout=2) as client:
+        return await asyncio.gather(
+            *(check_service(client, *check) for check in LGTM_HEALTH_CHECKS)
+        )
+
 def send_metrics_to_lgtm():
     print("🚀 Sending Playwright test metrics to LGTM stack...")
     
@@ -62,25 +100,20 @@ def send_metrics_to_lgtm():
         print(f"    - Avg Duration: {metrics['avg_duration']/1000:.1f}s")
     
     # Send to Prometheus (simulated)
-    prometheus_metrics = []
+    buffer = io.StringIO()
     for category, data in test_metrics.items():
-        prometheus_metrics.extend([
-            f'playwright_tests_total{{category="{category}",browser="chromium"}} {data["total"]}',
-            f'playwright_tests_passed{{category="{category}",browser="chromium"}} {data["passed"]}',
-            f'playwright_tests_failed{{category="{category}",browser="chromium"}} {data["failed"]}',
-            f'playwright_success_rate{{category="{category}",browser="chromium"}} {data["success_rate"]}',
-            f'playwright_avg_duration_ms{{category="{category}",browser="chromium"}} {data["avg_duration"]}'
-        ])
-    
-    prometheus_metrics.extend([
-        f'playwright_test_run_timestamp {timestamp}',
-        f'playwright_overall_success_rate {overall_success_rate}',
-        f'playwright_total_test_count {total_tests}',
-        f'playwright_execution_duration_minutes 15'
-    ])
+        buffer.write(PROMETHEUS_CATEGORY_TEMPLATE.format(category=category, data=data))
+    
+    buffer.write(
+        f'playwright_test_run_timestamp {timestamp}\n'
+        f'playwright_overall_success_rate {overall_success_rate}\n'
+        f'playwright_total_test_count {total_tests}\n'
+        f'playwright_execution_duration_minutes 15\n'
+    )
+    prometheus_metrics = buffer.getvalue()
     
     print(f"\\n📤 Prometheus Metrics (for LGTM integration):")
-    for metric in prometheus_metrics:
+    for metric in prometheus_metrics.splitlines():
         print(f"  {metric}")
     
     # Create structured logs for Loki
@@ -99,7 +132,7 @@ def send_metrics_to_lgtm():
     }
     
     print(f"\\n📝 Loki Structured Log:")
-    print(json.dumps(loki_logs, indent=2))
+    print(orjson.dumps(loki_logs, option=orjson.OPT_INDENT_2).decode())
     
     # Grafana annotation
     annotation = {
@@ -115,40 +148,13 @@ def send_metrics_to_lgtm():
     }
     
     print(f"\\n📈 Grafana Annotation:")
-    print(json.dumps(annotation, indent=2))
+    print(orjson.dumps(annotation, option=orjson.OPT_INDENT_2).decode())
     
     # Try to push metrics to actual endpoints
     print(f"\\n🔌 Attempting LGTM Stack Integration:")
     
-    # Check Prometheus
-    try:
-        response = requests.get("http://localhost:9090/api/v1/status/config", timeout=2)
-        if response.status_code == 200:
-            print("  ✅ Prometheus: Running and accessible")
-        else:
-            print("  ⚠️ Prometheus: Running but API returned non-200")
-    except:
-        print("  ❌ Prometheus: Not accessible")
-    
-    # Check Loki
-    try:
-        response = requests.get("http://localhost:3100/ready", timeout=2)
-        if response.status_code == 200:
-            print("  ✅ Loki: Running and accessible")
-        else:
-            print("  ⚠️ Loki: Running but health check failed")
-    except:
-        print("  ❌ Loki: Not accessible")
-    
-    # Check Grafana
-    try:
-        response = requests.get("http://localhost:3003/api/health", timeout=2)
-        if response.status_code == 200:
-            print("  ✅ Grafana: Running and accessible")
-        else:
-            print("  ⚠️ Grafana: Running but health check failed")
-    except:
-        print("  ❌ Grafana: Not accessible")
+    for status in asyncio.run(check_lgtm_services()):
+        print(status)
     
     print(f"\\n🎯 Key Insights:")
     print(f"  - Visual regression tests have highest success rate (62%)")